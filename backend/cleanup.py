@@ -0,0 +1,137 @@
+# Copyright (c) 2026 Julien Didier
+# Licensed under the MIT License
+import asyncio
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+# Folder (in the SnapchatExporter root) holding directories awaiting deletion.
+# Being on the same filesystem makes the move a single atomic rename.
+TRASH_DIRNAME = ".trash"
+
+
+class CleanupTask:
+    def __init__(self, path: Path, recreate: bool = False):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.recreate = recreate
+        self.status = "pending"
+        self.deleted_files = 0
+        self.deleted_bytes = 0
+        self.error: str | None = None
+        self.task: asyncio.Task | None = None
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "path": str(self.path),
+            "status": self.status,
+            "deleted_files": self.deleted_files,
+            "deleted_mb": round(self.deleted_bytes / 1024 / 1024, 2),
+            "error": self.error,
+        }
+
+    def delete_tree(self):
+        # Runs in a worker thread: bottom-up walk so progress can be reported
+        for root, dirs, files in os.walk(self.path, topdown=False):
+            for name in files:
+                file_path = os.path.join(root, name)
+                try:
+                    size = os.lstat(file_path).st_size
+                    os.unlink(file_path)
+                    self.deleted_files += 1
+                    self.deleted_bytes += size
+                except OSError as e:
+                    print(f"Failed to delete {file_path}: {e}")
+            for name in dirs:
+                dir_path = os.path.join(root, name)
+                try:
+                    if os.path.islink(dir_path):
+                        os.unlink(dir_path)
+                    else:
+                        os.rmdir(dir_path)
+                except OSError as e:
+                    print(f"Failed to delete {dir_path}: {e}")
+        # Whatever is left (permission errors...) is retried by rmtree
+        shutil.rmtree(self.path, ignore_errors=True)
+        if self.recreate:
+            self.path.mkdir(parents=True, exist_ok=True)
+
+
+class CleanupManager:
+    """
+    Clears directories without blocking the event loop: the directory is
+    renamed into a trash folder and recreated empty right away, then the
+    trash copy is deleted in a background thread.
+    """
+
+    def __init__(self):
+        self.tasks: dict[str, CleanupTask] = {}
+
+    def move_to_trash(self, path: Path, trash_root: Path | None = None) -> Path | None:
+        if not path.exists():
+            return None
+        # One trash per root, so purge_trash(root) finds everything
+        trash_dir = (trash_root or path.parent) / TRASH_DIRNAME
+        trash_dir.mkdir(parents=True, exist_ok=True)
+        trashed = trash_dir / f"{path.name}-{uuid.uuid4().hex[:8]}"
+        try:
+            path.rename(trashed)
+        except OSError as e:
+            # Rename refused (open file on Windows...): delete in place instead
+            print(f"Could not move {path} to trash, deleting in place: {e}")
+            return path
+        return trashed
+
+    def schedule(self, path: Path, recreate: bool = False) -> CleanupTask:
+        cleanup = CleanupTask(path, recreate)
+        self.tasks[cleanup.id] = cleanup
+
+        async def run():
+            cleanup.status = "running"
+            try:
+                await asyncio.to_thread(cleanup.delete_tree)
+                cleanup.status = "done"
+            except Exception as e:
+                cleanup.status = "error"
+                cleanup.error = str(e)
+                print(f"Cleanup of {path} failed: {e}")
+
+        cleanup.task = asyncio.create_task(run())
+        return cleanup
+
+    def clear_directory(
+        self, path: Path, recreate: bool = True, trash_root: Path | None = None
+    ) -> CleanupTask | None:
+        self.forget_finished()
+        trashed = self.move_to_trash(path, trash_root)
+        if trashed is None:
+            return None
+        if trashed == path:
+            return self.schedule(path, recreate=recreate)
+        if recreate:
+            path.mkdir(parents=True, exist_ok=True)
+        return self.schedule(trashed)
+
+    def purge_trash(self, root: Path) -> list[CleanupTask]:
+        # Leftovers from a previous session that was closed mid-cleanup
+        trash_dir = root / TRASH_DIRNAME
+        if not trash_dir.is_dir():
+            return []
+        # Skip what this session is already deleting
+        active = {cleanup.path for cleanup in self.tasks.values() if cleanup.status in ("pending", "running")}
+        return [self.schedule(item) for item in trash_dir.iterdir() if item not in active]
+
+    def summary(self) -> dict:
+        tasks = [cleanup.summary() for cleanup in self.tasks.values()]
+        running = any(task["status"] in ("pending", "running") for task in tasks)
+        return {"status": "running" if running else "idle", "tasks": tasks}
+
+    def forget_finished(self):
+        for cleanup_id, cleanup in list(self.tasks.items()):
+            if cleanup.status in ("done", "error"):
+                del self.tasks[cleanup_id]
+
+
+cleanup_manager = CleanupManager()
@@ -0,0 +1,121 @@
+# Copyright (c) 2026 Julien Didier
+# Licensed under the MIT License
+import json
+from array import array
+from bisect import bisect_left
+from datetime import datetime
+
+# Media types are stored as small integer codes instead of one str per item
+MEDIA_TYPES = ("image", "video")
+
+
+class DownloadHistory:
+    """
+    Append-only, compact history of exported files.
+
+    Each item is kept as a pre-encoded JSON fragment plus two typed columns
+    (timestamp, media type code) used for filtering, so a page is served by
+    joining bytes instead of building and re-validating one model per item.
+    """
+
+    __slots__ = ("_encoded", "_timestamps", "_media_codes", "_media_lookup")
+
+    def __init__(self):
+        self._encoded: list[bytes] = []
+        self._timestamps = array("d")
+        self._media_codes = array("b")
+        self._media_lookup = {name: code for code, name in enumerate(MEDIA_TYPES)}
+
+    def __len__(self):
+        return len(self._encoded)
+
+    def _media_code(self, media_type: str) -> int:
+        # Unknown media types get -1 so they still show up in unfiltered pages
+        return self._media_lookup.get(media_type.lower(), -1)
+
+    def append(self, filename: str, date: datetime, media_type: str, thumbnail: str | None = None):
+        media_type = media_type.lower()
+        fragment = json.dumps(
+            {"filename": filename, "date": date.isoformat(), "media_type": media_type, "thumbnail": thumbnail},
+            ensure_ascii=False,
+        )
+        self._encoded.append(fragment.encode("utf-8"))
+        self._timestamps.append(date.timestamp())
+        self._media_codes.append(self._media_code(media_type))
+
+    def clear(self):
+        self._encoded.clear()
+        del self._timestamps[:]
+        del self._media_codes[:]
+
+    def _matches(self, index: int, media_code, since, until) -> bool:
+        if media_code is not None and self._media_codes[index] != media_code:
+            return False
+        ts = self._timestamps[index]
+        if since is not None and ts < since:
+            return False
+        if until is not None and ts > until:
+            return False
+        return True
+
+    def page(
+        self,
+        offset: int = 0,
+        limit: int = 20,
+        cursor: int | None = None,
+        media_type: str | None = None,
+        since: datetime | None = None,
+        until: datetime | None = None,
+    ) -> bytes:
+        """
+        Return one page of history as a ready-to-send JSON document.
+
+        `cursor` is the index returned as `next_cursor` by the previous page;
+        when given it takes precedence over `offset`, which stays available for
+        the numbered pagination used by the frontend.
+        """
+        media_code = self._media_code(media_type) if media_type else None
+        since_ts = since.timestamp() if since else None
+        until_ts = until.timestamp() if until else None
+        filtered = media_code is not None or since_ts is not None or until_ts is not None
+
+        # Snapshot length: appends happening while we build the page are ignored
+        size = len(self._encoded)
+        next_cursor = None
+
+        if not filtered:
+            total = size
+            start = cursor if cursor is not None else offset
+            end = min(start + limit, size)
+            items = self._encoded[start:end]
+            if end < size:
+                next_cursor = end
+        else:
+            matching = [
+                i for i in range(size)
+                if self._matches(i, media_code, since_ts, until_ts)
+            ]
+            total = len(matching)
+            if cursor is not None:
+                # First matching index at or after the cursor
+                start = bisect_left(matching, cursor)
+            else:
+                start = offset
+            selected = matching[start:start + limit]
+            items = [self._encoded[i] for i in selected]
+            if start + limit < total:
+                next_cursor = matching[start + limit]
+
+        header = json.dumps({
+            "total": total,
+            "offset": start,
+            "limit": limit,
+            "next_cursor": next_cursor,
+        })
+        # Splice the pre-encoded items into the envelope without re-encoding them
+        return (
+            header[:-1].encode("utf-8")
+            + b', "items": ['
+            + b",".join(items)
+            + b"]}"
+        )
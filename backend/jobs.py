@@ -0,0 +1,233 @@
+# Copyright (c) 2026 Julien Didier
+# Licensed under the MIT License
+import asyncio
+import uuid
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+
+from cleanup import cleanup_manager
+from history import DownloadHistory
+from throttle import TokenBucket, InFlightBudget, DEFAULT_MAX_IN_FLIGHT_MB
+
+# Download slots shared by all running jobs
+DEFAULT_GLOBAL_CONCURRENCY = 20
+
+
+class FairShareLimiter:
+    """
+    Global concurrency budget shared between jobs.
+
+    When slots are contended, a freed slot goes to the waiting job that
+    currently holds the fewest slots, so N running jobs converge to an
+    equal share of the budget instead of the first one starving the others.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.in_use = 0
+        self.held: dict[str, int] = {}
+        self.waiters: dict[str, deque[asyncio.Future]] = {}
+
+    def _grant(self, job_id: str):
+        self.in_use += 1
+        self.held[job_id] = self.held.get(job_id, 0) + 1
+
+    def _wake_waiters(self):
+        while self.in_use < self.capacity and self.waiters:
+            job_id = min(self.waiters, key=lambda j: self.held.get(j, 0))
+            queue = self.waiters[job_id]
+            future = queue.popleft()
+            if not queue:
+                del self.waiters[job_id]
+            if not future.done():
+                self._grant(job_id)
+                future.set_result(None)
+
+    async def acquire(self, job_id: str):
+        if self.in_use < self.capacity and not self.waiters:
+            self._grant(job_id)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(job_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot granted while we were being cancelled: hand it back
+                self.release(job_id)
+            else:
+                queue = self.waiters.get(job_id)
+                if queue and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self.waiters[job_id]
+            raise
+
+    def release(self, job_id: str):
+        self.in_use -= 1
+        self.held[job_id] -= 1
+        if not self.held[job_id]:
+            del self.held[job_id]
+        self._wake_waiters()
+
+    def set_capacity(self, capacity: int):
+        self.capacity = capacity
+        self._wake_waiters()
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_use": self.in_use,
+            "held": dict(self.held),
+            "waiting": {job_id: len(queue) for job_id, queue in self.waiters.items()},
+        }
+
+
+class Job:
+    """
+    One export run: its own progress, pause switch, history and failures.
+    This is the `state` object passed through the service functions.
+    """
+
+    def __init__(
+        self,
+        output_dir: Path,
+        limiter: FairShareLimiter | None = None,
+        global_bandwidth: TokenBucket | None = None,
+        in_flight: InFlightBudget | None = None,
+    ):
+        self.id = uuid.uuid4().hex[:12]
+        self.output_dir = output_dir
+        self.uploads_dir: Path | None = None
+        self.created_at = datetime.now()
+        self.limiter = limiter
+        self.task: asyncio.Task | None = None
+
+        # Per-job rate on top of the global one shared with the other jobs
+        self.bandwidth = TokenBucket()
+        self.global_bandwidth = global_bandwidth
+        self.in_flight = in_flight if in_flight is not None else InFlightBudget(None)
+        self.bytes_received = 0
+        # ThumbnailCache when previews were requested for this job
+        self.thumbnails = None
+        # Optional callback(nbytes), e.g. a progress bar
+        self.on_bytes = None
+
+        self.progress = {"status": "idle", "downloaded": 0, "total": 0, "eta": None}
+        self.pause_event = asyncio.Event()
+        self.pause_event.set()  # Default -> allowed
+
+        self.downloaded_items = DownloadHistory()
+        self.failed_items = {}  # {filename: reason}
+        self.failed_items_lock = asyncio.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+    @asynccontextmanager
+    async def slot(self):
+        # Global download slot, fairly shared with the other jobs. A paused
+        # job never holds a slot while waiting, so others get its share.
+        while True:
+            await self.pause_event.wait()
+            if self.limiter is None:
+                yield
+                return
+            await self.limiter.acquire(self.id)
+            if self.pause_event.is_set():
+                break
+            # Paused while queued for the slot: hand it back
+            self.limiter.release(self.id)
+        try:
+            yield
+        finally:
+            self.limiter.release(self.id)
+
+    async def throttle(self, nbytes: int):
+        await self.bandwidth.consume(nbytes)
+        if self.global_bandwidth is not None:
+            await self.global_bandwidth.consume(nbytes)
+
+    def record_bytes(self, nbytes: int):
+        self.bytes_received += nbytes
+        if self.on_bytes is not None:
+            self.on_bytes(nbytes)
+
+    def pause(self):
+        self.pause_event.clear()
+        if self.running:
+            self.progress["status"] = "paused"
+
+    def resume(self):
+        self.pause_event.set()
+        if self.running:
+            self.progress["status"] = "running"
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            **self.progress,
+            "failed": len(self.failed_items),
+            "bandwidth": self.bandwidth.snapshot(),
+            "output_dir": str(self.output_dir),
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class JobManager:
+    def __init__(self, max_concurrent: int = DEFAULT_GLOBAL_CONCURRENCY):
+        self.limiter = FairShareLimiter(max_concurrent)
+        self.bandwidth = TokenBucket()
+        self.in_flight = InFlightBudget(DEFAULT_MAX_IN_FLIGHT_MB * 1024 * 1024)
+        self.jobs: dict[str, Job] = {}
+
+    def create(self, output_dir: Path, uploads_root: Path | None = None) -> Job:
+        job = Job(output_dir, self.limiter, self.bandwidth, self.in_flight)
+        # Each job gets its own upload folder so concurrent runs don't collide
+        if uploads_root is not None:
+            job.uploads_dir = uploads_root / job.id
+            job.uploads_dir.mkdir(parents=True, exist_ok=True)
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self.jobs.get(job_id)
+
+    def start(self, job: Job, coro) -> asyncio.Task:
+        job.progress["status"] = "running"
+        job.task = asyncio.create_task(coro)
+        job.task.add_done_callback(lambda task: self._task_done(job, task))
+        return job.task
+
+    def _task_done(self, job: Job, task: asyncio.Task):
+        # The upload folder (JSON, kept export ZIP) is only needed during the run
+        if job.uploads_dir is not None:
+            # <root>/uploads/<id>: trash it in <root>/.trash with the rest
+            cleanup_manager.clear_directory(job.uploads_dir, recreate=False, trash_root=job.uploads_dir.parents[1])
+        if task.cancelled():
+            return
+        if exc := task.exception():
+            print(f"Job {job.id} failed: {exc}")
+            job.progress["status"] = "error"
+        elif job.progress["status"] != "done":
+            job.progress["status"] = "done"
+
+    async def cancel(self, job: Job):
+        if job.running:
+            job.task.cancel()
+            try:
+                await job.task
+            except asyncio.CancelledError:
+                print(f"Job {job.id} cancelled successfully")
+        job.task = None
+        job.progress.update({"status": "idle", "eta": None})
+
+    def remove(self, job: Job):
+        self.jobs.pop(job.id, None)
+
+    def running_jobs(self) -> list[Job]:
+        return [job for job in self.jobs.values() if job.running]
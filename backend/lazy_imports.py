@@ -0,0 +1,21 @@
+# Copyright (c) 2026 Julien Didier
+# Licensed under the MIT License
+import importlib
+import time
+
+# Heavy libraries (PIL, piexif, httpx, tzlocal) are imported on first use so
+# the packaged backend can bind and answer /health right away.
+# Import durations in ms, exposed by /health/imports
+import_timings: dict[str, float] = {}
+
+def lazy_import(name: str):
+    # importlib waits on the module lock, so a module another thread is
+    # still initializing is never returned half-loaded. Only the first
+    # (real) import of a module is recorded.
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    import_timings.setdefault(name, round((time.perf_counter() - start) * 1000, 2))
+    return module
+
+def get_import_timings() -> dict[str, float]:
+    return dict(import_timings)
@@ -1,9 +1,12 @@
 # Copyright (c) 2026 Julien Didier
 # Licensed under the MIT License
+import time
+_import_start = time.perf_counter()
+
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, FileResponse
 import json
 
 from pydantic import BaseModel
@@ -12,30 +15,41 @@ from pathlib import Path
 import shutil
 import asyncio
 import logging
+import re
 
 import zipfile
-from service import run_import, get_progress as service_get_progress, pause_event, get_error_list
+from service import run_import
+from lazy_imports import get_import_timings
+from history import DownloadHistory
+from jobs import JobManager, Job
+from cleanup import cleanup_manager
+from throttle import DEFAULT_MAX_IN_FLIGHT_MB
+from thumbnails import ThumbnailCache
 
 from typing import List
 from datetime import datetime
 
+# Time spent importing the server modules before uvicorn can bind
+SERVER_IMPORT_MS = round((time.perf_counter() - _import_start) * 1000, 2)
+
 app = FastAPI()
-current_run_task: asyncio.Task | None = None
+job_manager = JobManager()
 
-def task_done_callback(task: asyncio.Task):
-    global current_run_task
-    current_run_task = None
+# Progress reported by the single-run endpoints when no job was started yet
+IDLE_PROGRESS = {"status": "idle", "downloaded": 0, "total": 0, "eta": None}
 
 #PAGINATION FOR DOWNLOADED ITEMS
 class DownloadedItemDTO(BaseModel):
     filename: str
     date: datetime
     media_type: str
+    thumbnail: str | None = None
 class DownloadedItemsPage(BaseModel):
     items: List[DownloadedItemDTO]
     total: int
     offset: int
     limit: int
+    next_cursor: int | None = None
 
 
 # Middleware CORS
@@ -53,11 +67,13 @@ app.add_middleware(
 
 @app.on_event("startup")
 async def startup():
-    app.state.downloaded_items = []
-    app.state.downloaded_items_lock = asyncio.Lock()
-    app.state.failed_items = {}  # {filename: reason}
-    app.state.failed_items_lock = asyncio.Lock()
-
+    # Job driven by the single-run endpoints (/run, /pause, /downloads...)
+    app.state.current_job = None
+    # Finish deleting what a previous session left in the trash
+    root_dir = Path.home() / "SnapchatExporter"
+    cleanup_manager.purge_trash(root_dir)
+    # Older versions trashed upload folders in uploads/.trash
+    cleanup_manager.purge_trash(root_dir / "uploads")
 
 # --- Setup folders ---
 def setup_directories(output_path: str | None = None):
@@ -76,18 +92,47 @@ def setup_directories(output_path: str | None = None):
 
     return uploads, downloads, root_dir
 
-@app.get("/progress/stream")
-async def progress_stream(request: Request):
+# --- Uploads ---
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+def spool_upload(source, target_path: Path):
+    # Fixed-size chunks keep memory flat for large uploads
+    source.seek(0)
+    with open(target_path, "wb") as target:
+        shutil.copyfileobj(source, target, UPLOAD_CHUNK_SIZE)
+
+def extract_memories_json(zip_source, uploads: Path) -> Path:
+    try:
+        if hasattr(zip_source, "seek"):
+            zip_source.seek(0)
+        with zipfile.ZipFile(zip_source, 'r') as zip_ref:
+            # Find memories_history.json anywhere in the zip
+            json_filename = next((name for name in zip_ref.namelist() if name.endswith("memories_history.json")), None)
+
+            if not json_filename:
+                raise HTTPException(400, "Aucun fichier 'memories_history.json' trouvé dans l'archive ZIP")
+
+            # Extract it to the uploads folder
+            json_path = uploads / "memories_history.json"
+            with zip_ref.open(json_filename) as source, open(json_path, "wb") as target:
+                shutil.copyfileobj(source, target, UPLOAD_CHUNK_SIZE)
+
+            print(f"RUN : Extracted {json_filename} to {json_path}")
+            return json_path
+    except zipfile.BadZipFile:
+        raise HTTPException(400, "Le fichier envoyé n'est pas un ZIP valide")
+
+# --- SSE ---
+def sse_response(request: Request, get_payload, interval: float):
     async def event_generator():
         try:
             while True:
                 if await request.is_disconnected():
                     break
 
-                progress = service_get_progress()
-                payload = json.dumps(progress)
+                payload = json.dumps(await get_payload())
                 yield f"data: {payload}\n\n"
-                await asyncio.sleep(0.5)
+                await asyncio.sleep(interval)
 
         except asyncio.CancelledError:
             raise
@@ -104,90 +149,102 @@ async def progress_stream(request: Request):
         },
     )
 
-@app.get("/file/error/stream")
-async def error_stream(request: Request):
-    async def event_generator():
-        try:
-            while True:
-                if await request.is_disconnected():
-                    break
+async def job_errors(job: Job | None) -> dict:
+    if job is None:
+        return {}
+    async with job.failed_items_lock:
+        return dict(job.failed_items)
+
+def history_page(job: Job | None, offset, limit, cursor, media_type, since, until) -> Response:
+    history = job.downloaded_items if job is not None else DownloadHistory()
+    # History pages are pre-encoded: skip response_model validation entirely
+    body = history.page(
+        offset=offset,
+        limit=limit,
+        cursor=cursor,
+        media_type=media_type,
+        since=since,
+        until=until,
+    )
+    return Response(content=body, media_type="application/json")
 
-                async with app.state.failed_items_lock:
-                    errorDict = dict(app.state.failed_items)
-                payload = json.dumps(errorDict)
-                yield f"data: {payload}\n\n"
-                await asyncio.sleep(5.0)
+@app.get("/progress/stream")
+async def progress_stream(request: Request):
+    async def payload():
+        job = app.state.current_job
+        return job.progress if job is not None else IDLE_PROGRESS
 
-        except asyncio.CancelledError:
-            raise
-        except Exception as e:
-            print("SSE error:", e)
+    return sse_response(request, payload, 0.5)
 
-    return StreamingResponse(
-        event_generator(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no",
-        },
-    )
+@app.get("/file/error/stream")
+async def error_stream(request: Request):
+    async def payload():
+        return await job_errors(app.state.current_job)
+
+    return sse_response(request, payload, 5.0)
 
 @app.get("/health")
 async def health():
     return {"status": "ok"}
 
+@app.get("/health/imports")
+async def health_imports():
+    # Startup import cost, then heavy libraries loaded lazily on first use
+    return {
+        "server_import_ms": SERVER_IMPORT_MS,
+        "lazy_imports_ms": get_import_timings(),
+    }
 
-# --- Endpoints ---
-@app.post("/run")
-async def run(
-    file: UploadFile = File(...),
-    output_path: str | None = Form(None),
-    concurrent: int = 10,
-    add_exif: bool = True,
-    skip_existing: bool = True,
-    merge_overlay: bool = Form(True),
-):
-    print("Received /run request")
-
-    print("RUN : Checking for existing tasks...")
-    global current_run_task
-    if current_run_task and not current_run_task.done():
-        raise HTTPException(409, "A download is already running")
 
+# --- Thumbnails ---
+THUMBNAIL_KEY_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+thumbnail_cache: ThumbnailCache | None = None
+
+async def get_thumbnail_cache() -> ThumbnailCache:
+    # Created on first opt-in: loading the index scans the cache folder
+    global thumbnail_cache
+    if thumbnail_cache is None:
+        cache_dir = Path.home() / "SnapchatExporter" / "thumbnails"
+        thumbnail_cache = await asyncio.to_thread(ThumbnailCache, cache_dir)
+    return thumbnail_cache
+
+@app.get("/thumbnails/{key}")
+async def get_thumbnail(key: str, request: Request):
+    if not THUMBNAIL_KEY_PATTERN.match(key):
+        raise HTTPException(404, "Unknown thumbnail")
+    cache = await get_thumbnail_cache()
+    path = cache.get(key)
+    if path is None:
+        raise HTTPException(404, "Unknown thumbnail")
+
+    # Content-addressed: a key always maps to the same image
+    headers = {
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "ETag": f'"{key}"',
+    }
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+@app.get("/thumbnails")
+async def get_thumbnails_stats():
+    return (await get_thumbnail_cache()).snapshot()
+
+# --- Jobs ---
+async def create_job(
+    file: UploadFile,
+    output_path: str | None,
+    concurrent: int,
+    add_exif: bool,
+    skip_existing: bool,
+    merge_overlay: bool,
+    use_local_media: bool,
+    thumbnails: bool = False,
+) -> Job:
     print("RUN : Setting up directories...")
     #Folders creation
     uploads, downloads, root_dir = setup_directories(output_path)
 
-    # Process the uploaded file
-    if file.filename.lower().endswith(".zip"):
-        print("RUN : ZIP file detected, extracting memories_history.json...")
-        try:
-            # Open ZIP from memory (in-memory file stream)
-            import io
-            zip_content = await file.read()
-            with zipfile.ZipFile(io.BytesIO(zip_content), 'r') as zip_ref:
-                # Find memories_history.json anywhere in the zip
-                json_filename = next((name for name in zip_ref.namelist() if name.endswith("memories_history.json")), None)
-                
-                if not json_filename:
-                    raise HTTPException(400, "Aucun fichier 'memories_history.json' trouvé dans l'archive ZIP")
-                
-                # Extract it to the uploads folder
-                json_path = uploads / "memories_history.json"
-                with zip_ref.open(json_filename) as source, open(json_path, "wb") as target:
-                    shutil.copyfileobj(source, target)
-                
-                print(f"RUN : Extracted {json_filename} to {json_path}")
-        except zipfile.BadZipFile:
-            raise HTTPException(400, "Le fichier envoyé n'est pas un ZIP valide")
-    else:
-        # If it's not a ZIP, we assume it's the JSON file itself (or we'll fail later)
-        json_path = uploads / file.filename
-        with open(json_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
-        print(f"RUN : Saved uploaded file to {json_path}")
-
     #output directory
     output_dir = downloads
 
@@ -199,13 +256,47 @@ async def run(
             raise HTTPException(status_code=400, detail="Invalid output directory")
         output_dir.mkdir(parents=True, exist_ok=True)
 
-    pause_event.set()  # start possible if paused
+    # Two jobs writing the same folder would race on skip_existing
+    if any(job.output_dir == output_dir for job in job_manager.running_jobs()):
+        raise HTTPException(409, "A download is already running for this output directory")
+
+    job = job_manager.create(output_dir, uploads)
+    job_uploads = job.uploads_dir
+    if thumbnails:
+        job.thumbnails = await get_thumbnail_cache()
 
-    print("RUN : Starting download task...")
+    # Process the uploaded file
+    media_zip = None
+    try:
+        if file.filename.lower().endswith(".zip"):
+            print("RUN : ZIP file detected, extracting memories_history.json...")
+            if use_local_media:
+                # Keep the archive: its memories/ folder is read during the run,
+                # the job's upload folder is removed when the run ends
+                media_zip = job_uploads / "export.zip"
+                await asyncio.to_thread(spool_upload, file.file, media_zip)
+                json_path = await asyncio.to_thread(extract_memories_json, media_zip, job_uploads)
+            else:
+                # The upload is already spooled to a temp file by the multipart parser:
+                # open the ZIP from it directly so only the central directory and the
+                # JSON member are read, whatever the size of the export.
+                json_path = await asyncio.to_thread(extract_memories_json, file.file, job_uploads)
+        else:
+            # If it's not a ZIP, we assume it's the JSON file itself (or we'll fail later)
+            json_path = job_uploads / Path(file.filename).name
+            await asyncio.to_thread(spool_upload, file.file, json_path)
+            print(f"RUN : Saved uploaded file to {json_path}")
+    except Exception:
+        job_manager.remove(job)
+        cleanup_manager.clear_directory(job_uploads, recreate=False, trash_root=root_dir)
+        raise
+
+    print(f"RUN : Starting download job {job.id}...")
     print(f"RUN : Merge Overlay: {merge_overlay}")
 
     # Start the download as an asynchronous task
-    current_run_task = asyncio.create_task(
+    job_manager.start(
+        job,
         run_import(
             json_path=json_path,
             output_dir=output_dir,
@@ -213,73 +304,192 @@ async def run(
             add_exif=add_exif,
             skip_existing=skip_existing,
             merge_overlay=merge_overlay,
-            state=app.state,
-        )
+            state=job,
+            media_zip=media_zip,
+        ),
     )
-    current_run_task.add_done_callback(task_done_callback)
+    return job
+
+def get_job_or_404(job_id: str) -> Job:
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(404, "Unknown job")
+    return job
+
+@app.get("/jobs")
+async def list_jobs():
+    return {
+        "jobs": [job.summary() for job in job_manager.jobs.values()],
+        "budget": job_manager.limiter.snapshot(),
+    }
+
+@app.post("/jobs")
+async def start_job(
+    file: UploadFile = File(...),
+    output_path: str | None = Form(None),
+    concurrent: int = 10,
+    add_exif: bool = True,
+    skip_existing: bool = True,
+    merge_overlay: bool = Form(True),
+    use_local_media: bool = Form(True),
+    thumbnails: bool = Form(False),
+):
+    job = await create_job(file, output_path, concurrent, add_exif, skip_existing, merge_overlay, use_local_media, thumbnails)
+    return {"job_id": job.id, "status": "running", "output_dir": str(job.output_dir)}
+
+@app.post("/jobs/budget")
+async def set_jobs_budget(max_concurrent: int = Form(..., ge=1)):
+    # Global number of download slots, divided fairly between running jobs
+    job_manager.limiter.set_capacity(max_concurrent)
+    return job_manager.limiter.snapshot()
+
+# --- Bandwidth ---
+def mb_to_bytes(value: float) -> int | None:
+    # 0 means unlimited
+    return int(value * 1024 * 1024) if value > 0 else None
+
+def bandwidth_snapshot() -> dict:
+    return {
+        **job_manager.bandwidth.snapshot(),
+        **job_manager.in_flight.snapshot(),
+    }
+
+@app.get("/bandwidth")
+async def get_bandwidth():
+    return bandwidth_snapshot()
+
+@app.post("/bandwidth")
+async def set_bandwidth(
+    max_mb_per_sec: float | None = Form(None, ge=0),
+    max_in_flight_mb: float | None = Form(None, ge=0),
+):
+    # Global limits shared by all jobs; fields left out are unchanged
+    if max_mb_per_sec is not None:
+        job_manager.bandwidth.set_rate(mb_to_bytes(max_mb_per_sec))
+    if max_in_flight_mb is not None:
+        job_manager.in_flight.set_limit(mb_to_bytes(max_in_flight_mb))
+    return bandwidth_snapshot()
+
+@app.post("/jobs/{job_id}/bandwidth")
+async def set_job_bandwidth(job_id: str, max_mb_per_sec: float = Form(..., ge=0)):
+    job = get_job_or_404(job_id)
+    job.bandwidth.set_rate(mb_to_bytes(max_mb_per_sec))
+    return job.bandwidth.snapshot()
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    return get_job_or_404(job_id).summary()
+
+@app.post("/jobs/{job_id}/pause")
+async def pause_job(job_id: str):
+    get_job_or_404(job_id).pause()
+    return {"status": "paused"}
+
+@app.post("/jobs/{job_id}/resume")
+async def resume_job(job_id: str):
+    get_job_or_404(job_id).resume()
+    return {"status": "running"}
+
+@app.delete("/jobs/{job_id}")
+async def delete_job(job_id: str):
+    # Cancels the job and forgets it; exported files are kept
+    job = get_job_or_404(job_id)
+    await job_manager.cancel(job)
+    job_manager.remove(job)
+    if app.state.current_job is job:
+        app.state.current_job = None
+    return {"status": "deleted"}
+
+@app.get("/jobs/{job_id}/progress/stream")
+async def job_progress_stream(job_id: str, request: Request):
+    job = get_job_or_404(job_id)
+
+    async def payload():
+        return job.progress
+
+    return sse_response(request, payload, 0.5)
+
+@app.get("/jobs/{job_id}/errors")
+async def get_job_errors(job_id: str):
+    return await job_errors(get_job_or_404(job_id))
+
+@app.get("/jobs/{job_id}/downloads", response_model=DownloadedItemsPage)
+async def get_job_downloads(
+    job_id: str,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=500),
+    cursor: int | None = Query(None, ge=0),
+    media_type: str | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
+):
+    job = get_job_or_404(job_id)
+    return history_page(job, offset, limit, cursor, media_type, since, until)
+
+
+# --- Endpoints ---
+# Single-run endpoints used by the UI, operating on app.state.current_job
+@app.post("/run")
+async def run(
+    file: UploadFile = File(...),
+    output_path: str | None = Form(None),
+    concurrent: int = 10,
+    add_exif: bool = True,
+    skip_existing: bool = True,
+    merge_overlay: bool = Form(True),
+    use_local_media: bool = Form(True),
+    thumbnails: bool = Form(False),
+):
+    print("Received /run request")
+
+    print("RUN : Checking for existing tasks...")
+    current_job = app.state.current_job
+    if current_job is not None and current_job.running:
+        raise HTTPException(409, "A download is already running")
+
+    job = await create_job(file, output_path, concurrent, add_exif, skip_existing, merge_overlay, use_local_media, thumbnails)
+    # The previous run is finished and no longer reachable from the UI
+    if current_job is not None:
+        job_manager.remove(current_job)
+    app.state.current_job = job
 
     return {
         "status": "running",
-        "output_dir": str(output_dir)
+        "output_dir": str(job.output_dir),
+        "job_id": job.id,
     }
 
 @app.post("/pause")
 def pause():
-    pause_event.clear()
-    progress = service_get_progress()
-    progress["status"] = "paused"
+    if app.state.current_job is not None:
+        app.state.current_job.pause()
     return {"status": "paused"}
 
 @app.post("/resume")
 def resume():
-    pause_event.set()
-    progress = service_get_progress()
-    progress["status"] = "running"
+    if app.state.current_job is not None:
+        app.state.current_job.resume()
     return {"status": "running"}
 
 @app.get("/downloads", response_model=DownloadedItemsPage)
 async def get_downloaded_items(
     offset: int = Query(0, ge=0),
     limit: int = Query(20, ge=1, le=500),
+    cursor: int | None = Query(None, ge=0),
+    media_type: str | None = Query(None),
+    since: datetime | None = Query(None),
+    until: datetime | None = Query(None),
 ):
-    async with app.state.downloaded_items_lock:
-        total = len(app.state.downloaded_items)
-        items = app.state.downloaded_items[offset : offset + limit]
-
-    return {
-        "items": items,
-        "total": total,
-        "offset": offset,
-        "limit": limit,
-    }
+    return history_page(app.state.current_job, offset, limit, cursor, media_type, since, until)
 
 @app.post("/restart")
 async def restart(output_path: str | None = Form(None)):
-    global current_run_task
-
-    #cancel current task
-    if current_run_task and not current_run_task.done():
-        current_run_task.cancel()
-        try:
-            await current_run_task
-        except asyncio.CancelledError:
-            print("Run task cancelled successfully")
-        finally:
-            current_run_task = None
-    else:
-        current_run_task = None
-
-    #stop any ongoing download
-    pause_event.clear()
-
-    #reset progress
-    progress = service_get_progress()
-    progress.update({
-        "status": "idle",
-        "downloaded": 0,
-        "total": 0,
-        "eta": None,
-    })
+    #cancel current job
+    job = app.state.current_job
+    if job is not None:
+        await job_manager.cancel(job)
+        job_manager.remove(job)
+        app.state.current_job = None
 
     # recalculate the exact same paths as in /run
     uploads, downloads, root_dir = setup_directories(output_path)
@@ -289,24 +499,38 @@ async def restart(output_path: str | None = Form(None)):
     if output_path:
         actual_downloads_dir = Path(output_path).expanduser().resolve() / "SnapchatExporter" / "downloads"
 
-    # Hard delete and recreate
-    for target_dir in [uploads, actual_downloads_dir]:
-        if target_dir.exists():
-            print(f"Deleting directory content: {target_dir}")
-            try:
-                shutil.rmtree(target_dir)
-                target_dir.mkdir(parents=True, exist_ok=True)
-            except Exception as e:
-                print(f"Error during deletion of {target_dir}: {e}")
-
-#clear downloaded and failed items
-    async with app.state.downloaded_items_lock:
-        app.state.downloaded_items.clear()
+    # (directory, recreate empty, root holding its trash)
+    targets = [(actual_downloads_dir, True, actual_downloads_dir.parent)]
+    # Other jobs may still be reading their own upload folder
+    if job_manager.running_jobs():
+        if job is not None and job.uploads_dir is not None:
+            targets.append((job.uploads_dir, False, job.uploads_dir.parents[1]))
+    else:
+        targets.append((uploads, True, root_dir))
+
+    # Never pull a folder from under a job still writing into it (POST /jobs)
+    busy_dirs = {running.output_dir for running in job_manager.running_jobs()}
+
+    # Rename away and recreate empty, actual deletion runs in the background
+    cleanups = []
+    for target_dir, recreate, trash_root in targets:
+        if target_dir in busy_dirs:
+            print(f"Skipping {target_dir}: a running job is writing into it")
+            continue
+        print(f"Deleting directory content: {target_dir}")
+        cleanup = cleanup_manager.clear_directory(target_dir, recreate=recreate, trash_root=trash_root)
+        if cleanup is not None:
+            cleanups.append(cleanup.id)
+
+    # Startup only purges the default root: finish a custom root's leftovers here
+    if output_path:
+        cleanups.extend(cleanup.id for cleanup in cleanup_manager.purge_trash(root_dir))
 
-    async with app.state.failed_items_lock:
-        app.state.failed_items.clear()
+    return {"status": "idle", "cleanup": cleanups}
 
-    return {"status": "idle"}
+@app.get("/cleanup")
+async def cleanup_status():
+    return cleanup_manager.summary()
 
 
 
@@ -322,9 +546,20 @@ if __name__ == "__main__":
 
     parser = argparse.ArgumentParser(description="SnapExporter Backend")
     parser.add_argument("--port", type=int, default=8000, help="Port to run the server on")
+    parser.add_argument("--max-concurrent", type=int, default=job_manager.limiter.capacity,
+                        help="Download slots shared by all running jobs")
+    parser.add_argument("--max-mb-per-sec", type=float, default=0,
+                        help="Global download bandwidth limit in MB/s (0 = unlimited)")
+    parser.add_argument("--max-in-flight-mb", type=float, default=DEFAULT_MAX_IN_FLIGHT_MB,
+                        help="Downloaded MB allowed to wait for disk writes (0 = unlimited)")
     args = parser.parse_args()
 
+    job_manager.limiter.set_capacity(args.max_concurrent)
+    job_manager.bandwidth.set_rate(mb_to_bytes(args.max_mb_per_sec))
+    job_manager.in_flight.set_limit(mb_to_bytes(args.max_in_flight_mb))
+
     logging.basicConfig(level=logging.WARNING)
+    print(f"Server modules imported in {SERVER_IMPORT_MS} ms", flush=True)
     print(f"Starting FastAPI server on port {args.port}...", flush=True)
 
     uvicorn.run(
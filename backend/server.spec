@@ -8,7 +8,8 @@ a = Analysis(
     pathex=[],
     binaries=[('bin/ffmpeg', 'bin')],
     datas=[],
-    hiddenimports=[],
+    # Imported lazily by service.py, not visible to the import scanner
+    hiddenimports=['PIL.Image', 'piexif', 'httpx', 'tzlocal'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -7,41 +7,64 @@ import os
 import re
 import sys
 import subprocess
+import contextlib
 import time
 from datetime import datetime
-from datetime import timezone
+from datetime import timezone, timedelta
 from pathlib import Path
 import io
 import zipfile
-from PIL import Image
+from urllib.parse import urlparse, parse_qs
 import tempfile
-from zoneinfo import ZoneInfo
-import piexif
-import httpx
 from pydantic import BaseModel, Field, field_validator
-from tqdm.asyncio import tqdm
-from tzlocal import get_localzone
+from cleanup import cleanup_manager
+from lazy_imports import lazy_import
 from datetime import datetime
 from asyncio import Lock
 from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional, Any
 
-state: Optional[Any] = None
-progress = {"status": "idle","downloaded": 0, "total": 0,"eta": None}
 
-# Global HTTP client
-http_client = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
+# Global HTTP client, created on first download
+http_client = None
 
-# ThreadPool for blocking tasks
-blocking_executor = ThreadPoolExecutor(max_workers=2)
+def get_http_client():
+    global http_client
+    if http_client is None:
+        httpx = lazy_import("httpx")
+        http_client = httpx.AsyncClient(timeout=30.0, follow_redirects=True)
+    return http_client
+
+# ThreadPool for blocking tasks, created on first use
+blocking_executor: ThreadPoolExecutor | None = None
+blocking_workers = 2
+
+def get_blocking_executor() -> ThreadPoolExecutor:
+    global blocking_executor
+    if blocking_executor is None:
+        blocking_executor = ThreadPoolExecutor(max_workers=blocking_workers)
+    return blocking_executor
+
+def configure_blocking_executor(max_workers: int):
+    # Must be called before the first blocking task
+    global blocking_workers
+    blocking_workers = max_workers
 
 async def run_blocking(func, *args, **kwargs):
     loop = asyncio.get_running_loop()
     return await loop.run_in_executor(
-        blocking_executor,
+        get_blocking_executor(),
         lambda: func(*args, **kwargs)
     )
 
+_local_tz = None
+
+def get_local_tz():
+    global _local_tz
+    if _local_tz is None:
+        _local_tz = lazy_import("tzlocal").get_localzone()
+    return _local_tz
+
 def format_eta(seconds: float) -> str:
     if seconds is None:
         return None
@@ -51,15 +74,6 @@ def format_eta(seconds: float) -> str:
     return f"{h:02}:{m:02}:{s:02}"
 
 
-# DOWNLOADED ITEM HISTORY
-class DownloadedItem(BaseModel):
-    filename: str
-    date: datetime
-    media_type: str
-
-pause_event = asyncio.Event()
-pause_event.set()  #Default -> allowed
-
 def get_ffmpeg_path():
     if getattr(sys, "frozen", False):
         base = Path(sys._MEIPASS)
@@ -69,6 +83,10 @@ def get_ffmpeg_path():
     exe = "ffmpeg.exe" if os.name == "nt" else "ffmpeg"
     return base / "bin" / exe
 
+# Assumed validity of a Snapchat link after its `ts`. Only the relative order of
+# expiries matters for scheduling, so the exact value is not critical.
+SNAPCHAT_LINK_LIFETIME = timedelta(days=7)
+
 class Memory(BaseModel):
     date: datetime = Field(alias="Date")
     media_type: str = Field(alias="Media Type")
@@ -85,7 +103,7 @@ class Memory(BaseModel):
             dt = datetime.strptime(v, "%Y-%m-%d %H:%M:%S UTC")
             dt = dt.replace(tzinfo=timezone.utc)
             # Convert to local Pacific Time (handles PST/PDT automatically)
-            local_tz = get_localzone()
+            local_tz = get_local_tz()
             return dt.astimezone(local_tz)
         return v
 
@@ -101,6 +119,36 @@ class Memory(BaseModel):
         ext = ".jpg" if self.media_type.lower() == "image" else ".mp4"
         return f"{self.date.strftime('%Y-%m-%d_%H-%M-%S')}{ext}"
 
+    @property
+    def link_expiry(self) -> datetime | None:
+        """
+        When the signed download link stops working, if the link tells us.
+        Explicit expiry params (Expires, exp, X-Amz-*) win; Snapchat links only
+        carry their signing time `ts`, to which an assumed lifetime is added.
+        """
+        query = {k.lower(): v[0] for k, v in parse_qs(urlparse(self.download_link).query).items()}
+        try:
+            for key in ("expires", "exp"):
+                if key in query:
+                    return datetime.fromtimestamp(int(query[key]), timezone.utc)
+            if "x-amz-date" in query and "x-amz-expires" in query:
+                signed = datetime.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+                return signed + timedelta(seconds=int(query["x-amz-expires"]))
+            if "ts" in query:
+                ts = int(query["ts"])
+                # Milliseconds in Snapchat links
+                signed = datetime.fromtimestamp(ts / 1000 if ts > 10**11 else ts, timezone.utc)
+                return signed + SNAPCHAT_LINK_LIFETIME
+        except (ValueError, OverflowError, OSError):
+            return None
+        return None
+
+    @property
+    def media_id(self) -> str | None:
+        # "mid" query parameter, also used to name media files in the export ZIP
+        query = parse_qs(urlparse(self.download_link).query)
+        return (query.get("mid") or [None])[0]
+
 class Stats(BaseModel):
     downloaded: int = 0
     skipped: int = 0
@@ -108,10 +156,27 @@ class Stats(BaseModel):
     mb: float = 0
 
 def load_memories(json_path: Path) -> list[Memory]:
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    if json_path.suffix.lower() == ".zip":
+        # Full export: read memories_history.json straight from the archive
+        with zipfile.ZipFile(json_path, "r") as zf:
+            json_filename = next((name for name in zf.namelist() if name.endswith("memories_history.json")), None)
+            if not json_filename:
+                raise ValueError(f"No memories_history.json found in {json_path.name}")
+            with zf.open(json_filename) as f:
+                data = json.load(f)
+    else:
+        with open(json_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
     return [Memory(**item) for item in data["Saved Media"]]
 
+# Optional output sub-folders, by memory date
+SHARD_FORMATS = {"year": "%Y", "month": "%Y/%m"}
+
+def memory_output_dir(output_dir: Path, memory: Memory, shard: str | None = None) -> Path:
+    if not shard:
+        return output_dir
+    return output_dir / memory.date.strftime(SHARD_FORMATS[shard])
+
 def add_exif_data(image_path: Path, memory: Memory):
     def to_deg(value):
         """Convert decimal degrees to (deg, min, sec)."""
@@ -130,6 +195,8 @@ def add_exif_data(image_path: Path, memory: Memory):
             (int(s * 100), 100)
         ]
 
+    piexif = lazy_import("piexif")
+
     try:
         # Load existing EXIF if any
         try:
@@ -237,118 +304,287 @@ def detect_image_ext(data: bytes) -> str:
         return ".jpg"
     return ".bin"
 
-async def download_memory(
-    memory: Memory, output_dir: Path, add_exif: bool, semaphore: asyncio.Semaphore, merge_overlay: bool, state=None
-) -> tuple[bool, int]:
-    async with semaphore:
-        await pause_event.wait()
-        try:
-            url = memory.download_link
-            output_path = output_dir / memory.filename
+# --- Local media bundled in the export ZIP ---
+# Export members look like "memories/2024-01-20_<mid>-main.jpg" / "-overlay.png"
+LOCAL_MEDIA_PATTERN = re.compile(
+    r"(?:^|/)\d{4}-\d{2}-\d{2}_([0-9A-Za-z-]+)-(main|overlay)\.\w+$"
+)
+
+class LocalMediaIndex:
+    """
+    Index of the media files bundled in a Snapchat export ZIP, keyed by the
+    `mid` of each memory's download link. Only the central directory is read
+    when building the index; members are decompressed on demand.
+    """
+
+    def __init__(self, zip_path: Path):
+        self.zip_path = zip_path
+        self.zip_file = zipfile.ZipFile(zip_path, "r")
+        self.entries: dict[str, dict[str, str]] = {}
+        for name in self.zip_file.namelist():
+            if match := LOCAL_MEDIA_PATTERN.search(name):
+                media_id, kind = match.groups()
+                self.entries.setdefault(media_id.lower(), {})[kind] = name
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, memory: Memory) -> dict[str, str] | None:
+        media_id = memory.media_id
+        if not media_id:
+            return None
+        entry = self.entries.get(media_id.lower())
+        if not entry or "main" not in entry:
+            return None
+        return entry
+
+    def read(self, entry: dict[str, str]) -> tuple[bytes, bytes | None]:
+        main_data = self.zip_file.read(entry["main"])
+        overlay_data = self.zip_file.read(entry["overlay"]) if "overlay" in entry else None
+        return main_data, overlay_data
+
+    def close(self):
+        self.zip_file.close()
+
+def write_media_zip(output_path: Path, members: dict[str, bytes]):
+    # Media is already compressed: store members as they are
+    with zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+
+async def write_merged_media(
+    memory: Memory, main_data: bytes, overlay_data: bytes | None, output_path: Path, on_image=None
+):
+    # on_image(img) is called in the worker thread with the merged image, while it is still decoded
+    if memory.media_type.lower() == "image":
+        # === IMAGE MERGE ===
+        def merge_image(main_data, overlay_data, output_path):
+            Image = lazy_import("PIL.Image")
+            with Image.open(io.BytesIO(main_data)).convert("RGBA") as main_img:
+                if overlay_data:
+                    with Image.open(io.BytesIO(overlay_data)).convert("RGBA") as overlay_img:
+                        overlay_resized = overlay_img.resize(main_img.size, Image.LANCZOS)
+                        main_img.alpha_composite(overlay_resized)
+
+                merged_img = main_img.convert("RGB")
+                merged_img.save(output_path, "JPEG")
+                if on_image is not None:
+                    on_image(merged_img)
+        await run_blocking(merge_image, main_data, overlay_data, output_path)
+    elif memory.media_type.lower() == "video":
+        # === VIDEO MERGE ===
+        with tempfile.TemporaryDirectory() as tmpdir:
+            main_path = Path(tmpdir) / "main.mp4"
+            merged_path = Path(tmpdir) / "merged.mp4"
+            await run_blocking(main_path.write_bytes, main_data)
+            if overlay_data:
+                try:
+                    # Validation / Overlay Normalization
+                    Image = lazy_import("PIL.Image")
+                    with Image.open(io.BytesIO(overlay_data)) as img:
+                        img = img.convert("RGBA")
+
+                        overlay_path = Path(tmpdir) / "overlay.png"
+                        img.save(overlay_path, "PNG")
+                except Exception as e:
+                    print("Overlay image invalide, fallback main only:", e)
+                    await run_blocking(output_path.write_bytes, main_data)
+                    return
+                try:
+                    FFMPEG = str(get_ffmpeg_path())
+                    await run_blocking(
+                        lambda: subprocess.run(
+                            [
+                                FFMPEG,
+                                "-y",
+                                "-i", str(main_path),
+                                "-i", str(overlay_path),
+                                "-filter_complex",
+                                "[1][0]scale2ref=w=iw:h=ih[overlay][base];[base][overlay]overlay=(W-w)/2:(H-h)/2",
+                                "-codec:a", "copy",
+                                str(merged_path),
+                            ],
+                            check=True,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL,
+                        )
+                    )
+
+                    await run_blocking(lambda: output_path.write_bytes(merged_path.read_bytes()))
+
+                except subprocess.CalledProcessError as e:
+                    print("Error during ffmepg process -> Bad overlay normalization")
+                    print("Saving main file only...")
+                    await run_blocking(output_path.write_bytes, main_data)
 
-            response = await http_client.get(url)
+            else:
+                # No overlay file
+                await run_blocking(output_path.write_bytes, main_data)
+    else:
+        raise ValueError(f"Unsupported media type: {memory.media_type}")
+
+# Read size for streamed downloads, also the bandwidth shaping granularity
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+async def fetch_media(url: str, state) -> tuple[bytes, str]:
+    """
+    Stream a download through the job's bandwidth limiters. Received bytes
+    are counted in the in-flight budget; on success the caller owns them
+    and must release them once written.
+    """
+    buffer = bytearray()
+    try:
+        async with get_http_client().stream("GET", url) as response:
             response.raise_for_status()
-            content = response.content
+            content_type = response.headers.get("Content-Type", "")
+            async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                await state.throttle(len(chunk))
+                state.in_flight.add(len(chunk))
+                state.record_bytes(len(chunk))
+                buffer += chunk
+    except BaseException:
+        state.in_flight.release(len(buffer))
+        raise
+    return bytes(buffer), content_type
+
+def thumbnail_hook(thumbnails, key: str | None):
+    # Thumbnail from an image that is already decoded (merge path), best effort
+    if thumbnails is None or key is None or thumbnails.has(key):
+        return None
+
+    def on_image(img):
+        try:
+            thumbnails.put_image(key, img)
+        except Exception as e:
+            print(f"Failed to create thumbnail: {e}")
+    return on_image
+
+async def create_thumbnail(thumbnails, key: str, output_path: Path, memory: Memory):
+    try:
+        if memory.media_type.lower() == "image":
+            await run_blocking(thumbnails.put_image_file, key, output_path)
+        elif memory.media_type.lower() == "video":
+            await run_blocking(thumbnails.put_video_file, key, output_path, str(get_ffmpeg_path()))
+    except Exception as e:
+        print(f"Failed to create thumbnail for {output_path.name}: {e}")
+
+# Redirects resolved ahead of the body transfer, see download_all
+MAX_REDIRECT_HOPS = 5
+RESOLVE_CONCURRENCY = 8
+# Resolved links queued per download worker: enough to never wait on a
+# redirect, small enough that resolved CDN links don't expire in the queue
+PREFETCH_PER_WORKER = 2
 
-            # Detect ZIP (overlay)
-            is_zip = response.headers.get("Content-Type", "").lower().startswith("application/zip")
+async def resolve_download_url(url: str) -> str:
+    """
+    Follow the redirect chain with HEAD requests and return the final URL.
+    Stops at the first host change (signed CDN links may refuse HEAD) and
+    falls back to the last known URL on any error.
+    """
+    client = get_http_client()
+    current = url
+    for _ in range(MAX_REDIRECT_HOPS):
+        try:
+            response = await client.head(current, follow_redirects=False)
+        except Exception:
+            return current
+        location = response.headers.get("Location")
+        if not response.is_redirect or not location:
+            return current
+        next_url = str(response.url.join(location))
+        if urlparse(next_url).netloc != urlparse(current).netloc:
+            return next_url
+        current = next_url
+    return current
+
+def link_expiry_sort_key(memory: Memory, now: datetime):
+    # Soonest expiry first, then links without expiry info, and links that
+    # already look expired (most likely to fail) last. The sort is stable.
+    expiry = memory.link_expiry
+    expired = expiry is not None and expiry < now
+    return (expired, expiry is None, expiry.timestamp() if expiry else 0)
 
-            if is_zip:
-                if not merge_overlay:
+async def download_memory(
+    memory: Memory, output_dir: Path, add_exif: bool, merge_overlay: bool, state=None,
+    local_media: LocalMediaIndex | None = None, shard: str | None = None, download_url: str | None = None,
+) -> tuple[bool, int]:
+    # Per-job concurrency is the number of download_all workers
+    async with state.slot():
+        # Backpressure: no new fetch while finished buffers wait for the disk
+        await state.in_flight.wait_available()
+        held_bytes = 0
+        thumbnails = state.thumbnails
+        thumbnail_key = None
+        # Merged and unmerged outputs of the same bytes get different previews
+        thumbnail_variant = b"merged" if merge_overlay else b"raw"
+        try:
+            output_path = memory_output_dir(output_dir, memory, shard) / memory.filename
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+
+            local_entry = local_media.lookup(memory) if local_media is not None else None
+
+            if local_entry is not None:
+                # === LOCAL SOURCE (media bundled in the export ZIP) ===
+                main_data, overlay_data = await run_blocking(local_media.read, local_entry)
+                bytes_downloaded = len(main_data) + len(overlay_data or b"")
+                held_bytes = bytes_downloaded
+                state.in_flight.add(held_bytes)
+                state.record_bytes(bytes_downloaded)
+                if thumbnails is not None:
+                    thumbnail_key = await run_blocking(thumbnails.key_for, thumbnail_variant, main_data, overlay_data or b"")
+                if overlay_data and merge_overlay:
+                    await write_merged_media(
+                        memory, main_data, overlay_data, output_path, thumbnail_hook(thumbnails, thumbnail_key)
+                    )
+                elif overlay_data:
+                    # Same layout as the HTTP download of this memory: a ZIP holding both parts
                     output_path = output_path.with_suffix(".zip")
-                    output_path.write_bytes(content)
-                    bytes_downloaded = len(content)
+                    await run_blocking(write_media_zip, output_path, {
+                        Path(local_entry["main"]).name: main_data,
+                        Path(local_entry["overlay"]).name: overlay_data,
+                    })
                 else:
-                    with zipfile.ZipFile(io.BytesIO(content)) as zf:
-                        files = zf.namelist()
-                        main_file = next((f for f in files if "-main" in f), None)
-                        overlay_file = next((f for f in files if "-overlay" in f), None)
-
-                        if not main_file:
-                            raise ValueError("No main media file found in ZIP.")
-
-                        main_data = zf.read(main_file)
-                        overlay_data = zf.read(overlay_file) if overlay_file else None
-
-                        if memory.media_type.lower() == "image":
-                            # === IMAGE MERGE ===
-                            def merge_image(main_data, overlay_data, output_path):
-                                with Image.open(io.BytesIO(main_data)).convert("RGBA") as main_img:
-                                    if overlay_data:
-                                        with Image.open(io.BytesIO(overlay_data)).convert("RGBA") as overlay_img:
-                                            overlay_resized = overlay_img.resize(main_img.size, Image.LANCZOS)
-                                            main_img.alpha_composite(overlay_resized)
-
-                                    merged_img = main_img.convert("RGB")
-                                    merged_img.save(output_path, "JPEG")
-                            await run_blocking(merge_image, main_data, overlay_data, output_path)
-                        elif memory.media_type.lower() == "video":
-                            # === VIDEO MERGE ===
-                            with tempfile.TemporaryDirectory() as tmpdir:
-                                main_path = Path(tmpdir) / "main.mp4"
-                                merged_path = Path(tmpdir) / "merged.mp4"
-                                with open(main_path, "wb") as f:
-                                    f.write(main_data)
-                                if overlay_data:
-                                    try:
-                                        # Validation / Overlay Normalization
-                                        with Image.open(io.BytesIO(overlay_data)) as img:
-                                            img = img.convert("RGBA")
-
-                                            overlay_path = Path(tmpdir) / "overlay.png"
-                                            img.save(overlay_path, "PNG")
-                                    except Exception as e:
-                                        print("Overlay image invalide, fallback main only:", e)
-                                        output_path.write_bytes(main_data)
-                                        return True, len(content)
-                                    try:
-                                        FFMPEG = str(get_ffmpeg_path())
-                                        dt_utc = memory.date.astimezone(timezone.utc)
-                                        iso_time = dt_utc.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
-                                        metadata_args = ["-metadata", f"creation_time={iso_time}"]
-                                        if memory.latitude is not None and memory.longitude is not None:
-                                            lat = f"{memory.latitude:+.4f}"
-                                            lon = f"{memory.longitude:+.4f}"
-                                            alt = getattr(memory, "altitude", 0.0)
-                                            iso6709 = f"{lat}{lon}+{alt:.3f}/"
-                                            metadata_args += ["-metadata", f"location={iso6709}", "-metadata", f"location-eng={iso6709}"]
-
-                                        await run_blocking(
-                                            lambda: subprocess.run(
-                                                [
-                                                    FFMPEG,
-                                                    "-y",
-                                                    "-i", str(main_path),
-                                                    "-i", str(overlay_path),
-                                                    "-filter_complex",
-                                                    "[1][0]scale2ref=w=iw:h=ih[overlay][base];[base][overlay]overlay=(W-w)/2:(H-h)/2",
-                                                    "-codec:a", "copy",
-                                                    str(merged_path),
-                                                ],
-                                                check=True,
-                                                stdout=subprocess.DEVNULL,
-                                                stderr=subprocess.DEVNULL,
-                                            )
-                                        )
-
-                                        output_path.write_bytes(merged_path.read_bytes())
-
-                                    except subprocess.CalledProcessError as e:
-                                        print("Error during ffmepg process -> Bad overlay normalization")
-                                        print("Saving main file only...")
-                                        output_path.write_bytes(main_data)
-
-                                else:
-                                    # No overlay file
-                                    output_path.write_bytes(main_data)
-                        else:
-                            raise ValueError(f"Unsupported media type: {memory.media_type}")
-
-                        bytes_downloaded = len(content)
+                    await run_blocking(output_path.write_bytes, main_data)
             else:
-                # === NORMAL DOWNLOAD (not ZIP) ===
-                output_path.write_bytes(content)
+                url = download_url or memory.download_link
+                try:
+                    content, content_type = await fetch_media(url, state)
+                except Exception as e:
+                    if url == memory.download_link:
+                        raise
+                    # Resolved link may have expired while queued: start over from the original one
+                    print(f"Resolved link failed for {memory.filename} ({e}), retrying original link")
+                    content, content_type = await fetch_media(memory.download_link, state)
                 bytes_downloaded = len(content)
+                held_bytes = bytes_downloaded
+                if thumbnails is not None:
+                    thumbnail_key = await run_blocking(thumbnails.key_for, thumbnail_variant, content)
+
+                # Detect ZIP (overlay)
+                is_zip = content_type.lower().startswith("application/zip")
+
+                if is_zip:
+                    if not merge_overlay:
+                        output_path = output_path.with_suffix(".zip")
+                        await run_blocking(output_path.write_bytes, content)
+                    else:
+                        with zipfile.ZipFile(io.BytesIO(content)) as zf:
+                            files = zf.namelist()
+                            main_file = next((f for f in files if "-main" in f), None)
+                            overlay_file = next((f for f in files if "-overlay" in f), None)
+
+                            if not main_file:
+                                raise ValueError("No main media file found in ZIP.")
+
+                            main_data = zf.read(main_file)
+                            overlay_data = zf.read(overlay_file) if overlay_file else None
+
+                        await write_merged_media(
+                            memory, main_data, overlay_data, output_path, thumbnail_hook(thumbnails, thumbnail_key)
+                        )
+                else:
+                    # === NORMAL DOWNLOAD (not ZIP) ===
+                    await run_blocking(output_path.write_bytes, content)
 
             # Set timestamps
             timestamp = memory.date.timestamp()
@@ -363,13 +599,21 @@ async def download_memory(
                 elif memory.media_type.lower() == "video":
                     await set_video_metadata(output_path, memory, state)
 
-            async with state.downloaded_items_lock:
+            # Optional preview, unless the merge step already made it
+            if thumbnail_key is not None and output_path.suffix != ".zip":
+                if not thumbnails.has(thumbnail_key):
+                    await create_thumbnail(thumbnails, thumbnail_key, output_path, memory)
+                if not thumbnails.has(thumbnail_key):
+                    thumbnail_key = None
+            else:
+                thumbnail_key = None
+
+            if state is not None:
                 state.downloaded_items.append(
-                    DownloadedItem(
-                        filename=output_path.name,
-                        date=memory.date,
-                        media_type=memory.media_type.lower(),
-                    )
+                    output_path.relative_to(output_dir).as_posix(),
+                    memory.date,
+                    memory.media_type,
+                    thumbnail_key,
                 )
 
             return True, bytes_downloaded
@@ -385,6 +629,9 @@ async def download_memory(
 
             return False, 0
 
+        finally:
+            state.in_flight.release(held_bytes)
+
 
 async def download_all(
     memories: list[Memory],
@@ -394,15 +641,19 @@ async def download_all(
     skip_existing: bool,
     merge_overlay: bool,
     state=None,
-):
-    semaphore = asyncio.Semaphore(max_concurrent)
+    local_media: LocalMediaIndex | None = None,
+    shard: str | None = None,
+) -> Stats:
+    progress = state.progress
     stats = Stats()
     start_time = time.time()
 
     to_download = []
     for memory in memories:
-        output_path = output_dir / memory.filename
-        if skip_existing and output_path.exists():
+        output_path = memory_output_dir(output_dir, memory, shard) / memory.filename
+        # Unmerged memories with an overlay are kept as "<name>.zip"
+        exists = output_path.exists() or (not merge_overlay and output_path.with_suffix(".zip").exists())
+        if skip_existing and exists:
             stats.skipped += 1
             stats.downloaded += 1
             # S'assurer qu'il n'est pas dans les erreurs s'il existe déjà
@@ -415,26 +666,35 @@ async def download_all(
 
     if not to_download:
         print("All files already downloaded!")
-        return
+        return stats
 
     progress["status"]="running"
     progress["total"] = len(to_download)
     progress["downloaded"] = stats.downloaded
     progress["eta"] = None
 
+    # Links are signed and expire: start with the ones expiring first
+    now = datetime.now(timezone.utc)
+    to_download.sort(key=lambda memory: link_expiry_sort_key(memory, now))
+    expired = sum(1 for m in to_download if m.link_expiry is not None and m.link_expiry < now)
+    if expired:
+        print(f"{expired} download links look already expired")
+
     print(f"Starting download of {len(to_download)} items...")
     print(f"merge requested ? {merge_overlay}")
 
-    async def process_and_update(memory):
+    async def process_and_update(memory, download_url):
         try:
-            await pause_event.wait()
+            await state.pause_event.wait()
             success, bytes_downloaded = await download_memory(
                 memory,
                 output_dir,
                 add_exif,
-                semaphore,
                 merge_overlay,
                 state,
+                local_media,
+                shard,
+                download_url,
             )
         except asyncio.CancelledError:
             raise
@@ -464,14 +724,52 @@ async def download_all(
         #progress_bar.set_postfix({"MB/s": f"{mb_per_sec:.2f}"}, refresh=False)
         #progress_bar.update(1)
 
+    # Pipeline: the producer resolves redirects a bounded window ahead, the
+    # workers only do body transfers and processing.
+    resolve_semaphore = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_concurrent * PREFETCH_PER_WORKER)
+
+    async def resolve(memory):
+        if local_media is not None and local_media.lookup(memory) is not None:
+            return None
+        async with resolve_semaphore:
+            await state.pause_event.wait()
+            return await resolve_download_url(memory.download_link)
+
+    # Every resolution not finished yet, including one blocked on queue.put
+    resolving_tasks: set[asyncio.Task] = set()
+
+    async def producer():
+        for memory in to_download:
+            resolving = asyncio.create_task(resolve(memory))
+            resolving_tasks.add(resolving)
+            resolving.add_done_callback(resolving_tasks.discard)
+            await queue.put((memory, resolving))
+        for _ in range(max_concurrent):
+            await queue.put(None)
+
+    async def worker():
+        while (item := await queue.get()) is not None:
+            memory, resolving = item
+            try:
+                download_url = await resolving
+            except Exception as e:
+                print(f"Could not resolve link for {memory.filename}: {e}")
+                download_url = None
+            await process_and_update(memory, download_url)
+
     try:
         await asyncio.gather(
-            *[process_and_update(m) for m in to_download],
+            producer(),
+            *[worker() for _ in range(max_concurrent)],
             return_exceptions=False
         )
 
     except asyncio.CancelledError:
         print("Download cancelled")
+        # Drop resolutions still pending, queued or not
+        for resolving in list(resolving_tasks):
+            resolving.cancel()
         raise
 
     elapsed = time.time() - start_time
@@ -488,13 +786,7 @@ async def download_all(
         for f in state.failed_items:
             print("-", f)
 
-    return
-
-def get_progress():
-    return progress
-
-def get_error_list(state):
-    return getattr(state, "failed_items", [])
+    return stats
 
 async def run_import(
     json_path: Path,
@@ -504,50 +796,192 @@ async def run_import(
     skip_existing: bool = True,
     merge_overlay: bool = True,
     state=None,
-):
+    media_zip: Path | None = None,
+    shard: str | None = None,
+) -> Stats:
     memories = load_memories(json_path)
 
-    global downloaded_items
-    async with state.downloaded_items_lock:
-        state.downloaded_items.clear()
+    state.downloaded_items.clear()
     async with state.failed_items_lock:
         state.failed_items.clear()
 
-    await download_all(
-        memories=memories,
-        output_dir=output_dir,
-        max_concurrent=concurrent,
-        add_exif=add_exif,
-        skip_existing=skip_existing,
-        merge_overlay=merge_overlay,
-        state=state,
-    )
+    # Media bundled in the export is used first, HTTP only for missing items
+    local_media = None
+    if media_zip is not None:
+        try:
+            local_media = await run_blocking(LocalMediaIndex, media_zip)
+            print(f"Found {len(local_media)} media files in {media_zip.name}")
+        except (OSError, zipfile.BadZipFile) as e:
+            print(f"Could not index local media in {media_zip}: {e}")
+
+    try:
+        return await download_all(
+            memories=memories,
+            output_dir=output_dir,
+            max_concurrent=concurrent,
+            add_exif=add_exif,
+            skip_existing=skip_existing,
+            merge_overlay=merge_overlay,
+            state=state,
+            local_media=local_media,
+            shard=shard,
+        )
+    finally:
+        if local_media is not None:
+            local_media.close()
 
 
-def reset_state(state, output_dir: Path):
+async def reset_state(state, output_dir: Path):
     #Stop logique
-    pause_event.clear()
+    state.pause_event.clear()
 
     #Reset progress
-    progress["status"] = "idle"
-    progress["downloaded"] = 0
-    progress["total"] = 0
-    progress["eta"] = None
+    state.progress["status"] = "idle"
+    state.progress["downloaded"] = 0
+    state.progress["total"] = 0
+    state.progress["eta"] = None
 
-    #Delete previous files generated
-    if output_dir.exists():
-        for item in output_dir.iterdir():
-            try:
-                if item.is_file():
-                    item.unlink()
-            except Exception as e:
-                print(f"Failed to delete {item}: {e}")
+    #Delete previous files generated (renamed away now, deleted in background)
+    cleanup = cleanup_manager.clear_directory(output_dir)
 
     #Reset histories
-    async def clear_state():
-        async with state.downloaded_items_lock:
-            state.downloaded_items.clear()
-        async with state.failed_items_lock:
-            state.failed_items.clear()
+    state.downloaded_items.clear()
+    async with state.failed_items_lock:
+        state.failed_items.clear()
+
+    return cleanup
+
+
+# --- HEADLESS CLI ---
+def export_folder_names(exports: list[Path]) -> list[str]:
+    # JSON exports are nearly always all named memories_history.json: tell
+    # them apart by their parent folder, then by an index if still needed
+    names = []
+    for export in exports:
+        name = export.stem
+        if sum(other.stem == export.stem for other in exports) > 1:
+            name = f"{export.parent.name}-{export.stem}"
+        unique, index = name, 2
+        while unique in names:
+            unique = f"{name}-{index}"
+            index += 1
+        names.append(unique)
+    return names
+
+async def run_batch(args) -> dict:
+    from jobs import JobManager
+    from throttle import DEFAULT_MAX_IN_FLIGHT_MB
+
+    tqdm = lazy_import("tqdm").tqdm
+
+    manager = JobManager(max_concurrent=args.max_concurrent)
+    manager.bandwidth.set_rate(args.max_mb_per_sec * 1024 * 1024 if args.max_mb_per_sec > 0 else None)
+    max_in_flight = args.max_in_flight_mb if args.max_in_flight_mb is not None else DEFAULT_MAX_IN_FLIGHT_MB
+    manager.in_flight.set_limit(int(max_in_flight * 1024 * 1024) if max_in_flight > 0 else None)
+
+    output_root = Path(args.output).expanduser().resolve()
+    exports = [Path(p).expanduser().resolve() for p in args.exports]
+    progress_bar = tqdm(unit="B", unit_scale=True, unit_divisor=1024, desc="Exporting", disable=args.quiet)
+
+    thumbnails = None
+    if args.thumbnails:
+        from thumbnails import ThumbnailCache, DEFAULT_MAX_CACHE_MB
+        cache_mb = args.thumbnail_cache_mb or DEFAULT_MAX_CACHE_MB
+        thumbnails = ThumbnailCache(output_root / ".thumbnails", int(cache_mb * 1024 * 1024))
+
+    runs = []
+    for export, folder_name in zip(exports, export_folder_names(exports)):
+        # One sub-folder per export when several are processed together
+        output_dir = output_root / folder_name if len(exports) > 1 else output_root
+        output_dir.mkdir(parents=True, exist_ok=True)
+        job = manager.create(output_dir)
+        job.on_bytes = progress_bar.update
+        job.thumbnails = thumbnails
+        use_zip_media = export.suffix.lower() == ".zip" and not args.no_local_media
+        manager.start(
+            job,
+            run_import(
+                json_path=export,
+                output_dir=output_dir,
+                concurrent=args.concurrent,
+                add_exif=not args.no_exif,
+                skip_existing=not args.no_skip_existing,
+                merge_overlay=not args.no_merge_overlay,
+                state=job,
+                media_zip=export if use_zip_media else None,
+                shard=args.shard,
+            ),
+        )
+        runs.append((export, job))
+
+    start_time = time.time()
+    try:
+        while any(job.running for _, job in runs):
+            done = sum(job.progress["downloaded"] for _, job in runs)
+            total = sum(job.progress["total"] for _, job in runs)
+            progress_bar.set_postfix_str(f"{done}/{total} files", refresh=False)
+            await asyncio.sleep(0.5)
+    finally:
+        progress_bar.close()
+    elapsed = time.time() - start_time
+
+    summary = {"exports": [], "elapsed_seconds": round(elapsed, 1)}
+    for export, job in runs:
+        result = {
+            "export": str(export),
+            "output_dir": str(job.output_dir),
+            "status": job.progress["status"],
+            "mb": round(job.bytes_received / 1024 / 1024, 2),
+            "failed_items": dict(job.failed_items),
+        }
+        if job.task.exception() is None:
+            stats = job.task.result()
+            result.update(stats.model_dump(include={"downloaded", "skipped", "failed"}))
+        else:
+            result["error"] = str(job.task.exception())
+        summary["exports"].append(result)
+
+    total_mb = sum(result["mb"] for result in summary["exports"])
+    summary["mb"] = round(total_mb, 2)
+    summary["mb_per_sec"] = round(total_mb / elapsed, 2) if elapsed > 0 else 0
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="SnapExporter headless export: runs the same engine as the backend, without the server."
+    )
+    parser.add_argument("exports", nargs="+", help="memories_history.json files or full Snapchat export ZIPs")
+    parser.add_argument("-o", "--output", default="downloads", help="Output folder (one sub-folder per export when several are given)")
+    parser.add_argument("-c", "--concurrent", type=int, default=10, help="Concurrent downloads per export")
+    parser.add_argument("--max-concurrent", type=int, default=20, help="Download slots shared by all exports")
+    parser.add_argument("--workers", type=int, default=blocking_workers, help="Threads for image merge, EXIF and ffmpeg")
+    parser.add_argument("--max-mb-per-sec", type=float, default=0, help="Global bandwidth limit in MB/s (0 = unlimited)")
+    parser.add_argument("--max-in-flight-mb", type=float, default=None, help="Downloaded MB allowed to wait for disk writes (0 = unlimited)")
+    parser.add_argument("--shard", choices=sorted(SHARD_FORMATS), default=None, help="Split output in sub-folders by date")
+    parser.add_argument("--no-exif", action="store_true", help="Do not write EXIF / video metadata")
+    parser.add_argument("--no-skip-existing", action="store_true", help="Re-download files already present")
+    parser.add_argument("--no-merge-overlay", action="store_true", help="Keep overlays separate instead of merging them")
+    parser.add_argument("--no-local-media", action="store_true", help="Always download, even if the ZIP contains the media")
+    parser.add_argument("--thumbnails", action="store_true", help="Also write WebP previews to <output>/.thumbnails")
+    parser.add_argument("--thumbnail-cache-mb", type=float, default=None, help="Size limit of the preview cache")
+    parser.add_argument("--summary", default=None, help="Write the JSON summary to this file instead of stdout")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Hide the progress bar")
+    args = parser.parse_args(argv)
+
+    configure_blocking_executor(args.workers)
+    # Engine logs go to stderr so stdout only carries the JSON summary
+    with contextlib.redirect_stdout(sys.stderr):
+        summary = asyncio.run(run_batch(args))
+
+    payload = json.dumps(summary, indent=2, ensure_ascii=False)
+    if args.summary:
+        Path(args.summary).write_text(payload, encoding="utf-8")
+    else:
+        print(payload)
+
+    failed = any(result.get("error") or result.get("failed") for result in summary["exports"])
+    return 1 if failed else 0
+
 
-    return clear_state()
+if __name__ == "__main__":
+    sys.exit(main())
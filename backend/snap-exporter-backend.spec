@@ -11,7 +11,8 @@ a = Analysis(
         ('bin/ffmpeg.exe', 'bin'),
     ],
     datas=[],
-    hiddenimports=[],
+    # Imported lazily by service.py, not visible to the import scanner
+    hiddenimports=['PIL.Image', 'piexif', 'httpx', 'tzlocal'],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
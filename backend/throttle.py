@@ -0,0 +1,90 @@
+# Copyright (c) 2026 Julien Didier
+# Licensed under the MIT License
+import asyncio
+import time
+
+# Bytes fetched but not yet written to disk, across all jobs
+DEFAULT_MAX_IN_FLIGHT_MB = 512
+
+
+class TokenBucket:
+    """
+    Bandwidth limiter in bytes per second; a rate of None means unlimited.
+
+    Consumers may go into debt by one chunk and then sleep it off, so chunk
+    sizes larger than the bucket still work at low rates. The lock keeps
+    waiting consumers in FIFO order.
+    """
+
+    def __init__(self, rate: float | None = None):
+        self.rate = None
+        self.capacity = 0.0
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.set_rate(rate)
+
+    def set_rate(self, rate: float | None):
+        self.rate = rate if rate and rate > 0 else None
+        # One second of burst
+        self.capacity = self.rate or 0.0
+        self.tokens = min(self.tokens, self.capacity)
+        self.updated = time.monotonic()
+
+    async def consume(self, nbytes: int):
+        if self.rate is None:
+            return
+        async with self.lock:
+            rate = self.rate
+            if rate is None:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= nbytes
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / rate)
+
+    def snapshot(self) -> dict:
+        return {"max_mb_per_sec": round(self.rate / 1024 / 1024, 3) if self.rate else None}
+
+
+class InFlightBudget:
+    """
+    Bounds the bytes held in memory between fetch and disk write. New
+    fetches wait while the budget is exceeded, i.e. while writes are behind.
+    """
+
+    def __init__(self, limit: int | None):
+        self.limit = None
+        self.in_flight = 0
+        self.available = asyncio.Event()
+        self.set_limit(limit)
+
+    def _update(self):
+        if self.limit is None or self.in_flight < self.limit:
+            self.available.set()
+        else:
+            self.available.clear()
+
+    async def wait_available(self):
+        while not self.available.is_set():
+            await self.available.wait()
+
+    def add(self, nbytes: int):
+        self.in_flight += nbytes
+        self._update()
+
+    def release(self, nbytes: int):
+        self.in_flight -= nbytes
+        self._update()
+
+    def set_limit(self, limit: int | None):
+        self.limit = limit if limit and limit > 0 else None
+        self._update()
+
+    def snapshot(self) -> dict:
+        return {
+            "max_in_flight_mb": round(self.limit / 1024 / 1024, 1) if self.limit else None,
+            "in_flight_mb": round(self.in_flight / 1024 / 1024, 1),
+        }
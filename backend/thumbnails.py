@@ -0,0 +1,135 @@
+# Copyright (c) 2026 Julien Didier
+# Licensed under the MIT License
+import hashlib
+import os
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+from lazy_imports import lazy_import
+
+THUMBNAIL_SIZE = (320, 320)
+THUMBNAIL_QUALITY = 70
+DEFAULT_MAX_CACHE_MB = 256
+
+
+class ThumbnailCache:
+    """
+    Content-addressed WebP thumbnails with LRU eviction.
+
+    Keys are the sha256 of the media bytes a file was produced from and of
+    how it was produced (overlay merged or not), so the same memory exported
+    twice the same way (or by two jobs) is only thumbnailed once.
+    Recency is kept in the file mtimes, so the LRU order survives restarts.
+    Puts run in worker threads, hence the lock around the index.
+    """
+
+    def __init__(self, cache_dir: Path, max_bytes: int = DEFAULT_MAX_CACHE_MB * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[str, int] = OrderedDict()  # key -> size, oldest first
+        self.total_bytes = 0
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.cache_dir.glob("*/*.webp"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self.entries[path.stem] = size
+            self.total_bytes += size
+
+    @staticmethod
+    def key_for(*chunks: bytes) -> str:
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            digest.update(chunk)
+        return digest.hexdigest()[:32]
+
+    def path_for(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.webp"
+
+    def has(self, key: str) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def get(self, key: str) -> Path | None:
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except OSError:
+            with self.lock:
+                self._forget(key)
+            return None
+        return path
+
+    def _forget(self, key: str):
+        size = self.entries.pop(key, None)
+        if size is not None:
+            self.total_bytes -= size
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, _ = next(iter(self.entries.items()))
+            self._forget(key)
+            self.path_for(key).unlink(missing_ok=True)
+
+    def put_image(self, key: str, image):
+        """Store a thumbnail of an already decoded PIL image (not modified)."""
+        Image = lazy_import("PIL.Image")
+        thumb = image.copy()
+        thumb.thumbnail(THUMBNAIL_SIZE, Image.BILINEAR)
+        if thumb.mode not in ("RGB", "RGBA"):
+            thumb = thumb.convert("RGB")
+
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename so a reader never sees a partial file
+        tmp_path = path.with_name(f"{key}.{threading.get_ident()}.tmp")
+        thumb.save(tmp_path, "WEBP", quality=THUMBNAIL_QUALITY)
+        tmp_path.replace(path)
+
+        with self.lock:
+            self._forget(key)
+            self.entries[key] = path.stat().st_size
+            self.total_bytes += self.entries[key]
+            self._evict()
+
+    def put_image_file(self, key: str, image_path: Path):
+        Image = lazy_import("PIL.Image")
+        with Image.open(image_path) as img:
+            # JPEG can decode straight at a reduced scale
+            img.draft("RGB", THUMBNAIL_SIZE)
+            self.put_image(key, img)
+
+    def put_video_file(self, key: str, video_path: Path, ffmpeg: str):
+        # Poster frame: first frame, scaled down by ffmpeg
+        with tempfile.TemporaryDirectory() as tmpdir:
+            frame_path = Path(tmpdir) / "poster.png"
+            subprocess.run(
+                [
+                    ffmpeg,
+                    "-y",
+                    "-i", str(video_path),
+                    "-frames:v", "1",
+                    "-vf", f"scale={THUMBNAIL_SIZE[0]}:{THUMBNAIL_SIZE[1]}:force_original_aspect_ratio=decrease",
+                    str(frame_path),
+                ],
+                check=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            self.put_image_file(key, frame_path)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "mb": round(self.total_bytes / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            }
@@ -3,12 +3,14 @@
 "use client"
 
 import { useEffect, useState, useRef } from "react";
+import Image from "next/image";
 import {useProgress} from "@/app/upload/progressContext";
 
 export interface DownloadedItemDTO {
     filename: string;
     date: string;
     media_type: string;
+    thumbnail: string | null;
 }
 
 export interface DownloadsPageDTO {
@@ -16,6 +18,7 @@ export interface DownloadsPageDTO {
     total: number;
     offset: number;
     limit: number;
+    next_cursor: number | null;
 }
 
 import { useLanguage } from "../languageContext";
@@ -125,7 +128,18 @@ export default function DownloadHistory() {
                                     ) : (
                                         downloadedItems.map((item, i) => (
                                             <li key={i}>
-                                                <span className="text-lg">{item.media_type === "image" ? "🖼️" : "🎬"}</span>
+                                                {item.thumbnail ? (
+                                                    <Image
+                                                        src={`${backendUrl}/thumbnails/${item.thumbnail}`}
+                                                        alt=""
+                                                        width={40}
+                                                        height={40}
+                                                        unoptimized
+                                                        className="w-10 h-10 object-cover rounded"
+                                                    />
+                                                ) : (
+                                                    <span className="text-lg">{item.media_type === "image" ? "🖼️" : "🎬"}</span>
+                                                )}
                                                 <div className="flex flex-col">
                                                     <span className="font-bold truncate max-w-[200px] text-zinc-900 dark:text-zinc-200">{item.filename}</span>
                                                     <span className="text-[10px] font-medium text-zinc-500 dark:text-zinc-400">{new Date(item.date).toLocaleString()}</span>
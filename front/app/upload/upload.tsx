@@ -131,6 +131,7 @@ export default function UploadForm() {
 
     const [outputPath, setOutputPath] = useState("");
     const [mergeOverlay, setMergeOverlay] = useState(true);
+    const [thumbnails, setThumbnails] = useState(false);
 
     const fileInputRef = useRef<HTMLInputElement | null>(null);
     const [jsonExportFile, setJsonExportFile] = useState<File | null>(null);
@@ -166,6 +167,7 @@ export default function UploadForm() {
             formData.append("file", jsonExportFile);
             formData.append("output_path", outputPath);
             formData.append("merge_overlay", mergeOverlay.toString());
+            formData.append("thumbnails", thumbnails.toString());
 
             await fetch(`${backendUrl}/run`, {
                 method: "POST",
@@ -325,6 +327,22 @@ export default function UploadForm() {
                                 <InfoTooltip text={t.upload.tooltip_merge} tooltipTitle={t.tutorial.continue} />
                             </div>
                         )}
+                        {(progress.status === "idle" || showSettings) && (
+                            <div className="flex items-center gap-3 w-full justify-center bg-white dark:bg-zinc-800 p-3 rounded-xl border border-zinc-100 dark:border-zinc-700 shadow-sm animate-in fade-in duration-300">
+                                <input
+                                    type="checkbox"
+                                    id="thumbnails"
+                                    checked={thumbnails}
+                                    disabled={progress.status !== "idle"}
+                                    onChange={(e) => setThumbnails(e.target.checked)}
+                                    className="w-5 h-5 cursor-pointer accent-zinc-900 dark:accent-zinc-100 rounded border-zinc-300"
+                                />
+                                <label htmlFor="thumbnails" className="text-sm text-zinc-700 dark:text-zinc-300 font-semibold cursor-pointer select-none">
+                                    {t.upload.thumbnails}
+                                </label>
+                                <InfoTooltip text={t.upload.tooltip_thumbnails} tooltipTitle={t.tutorial.continue} />
+                            </div>
+                        )}
                         <div className="flex gap-4 w-full justify-center">
                             {progress.status === "idle" && (
                                 <button